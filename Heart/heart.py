@@ -1,9 +1,13 @@
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import GridSearchCV
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import MinMaxScaler, PolynomialFeatures
 from sklearn.pipeline import Pipeline
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.metrics import confusion_matrix
+import numpy as np
+import pandas as pd
+import time
+from functools import partial
 
 # -------------------
 # -- Global variables
@@ -19,6 +23,8 @@ k_cv = 10 # Number of folds for cross-validation
 
 class Translate(TransformerMixin, BaseEstimator):
     '''This transformer changes the names of the features and labels based on a "translation" dictionnary.
+    The data itself is not copied: the result shares it with the input.
+    Arrays have no names, they are returned untouched.
     Parameters
     ----------
     names_dict : a dictionnary containing the translations. Keys are the current names, and values are the translations.'''
@@ -28,8 +34,8 @@ class Translate(TransformerMixin, BaseEstimator):
     def fit(self, X, y=None):
         '''X is assumed to be a pandas array, and y None, or a pandas series'''
         # The only thing to do is to check that every translation is provided
-        to_translate = list(X.columns)
-        if y is not None:
+        to_translate = list(getattr(X, 'columns', []))
+        if y is not None and getattr(y, 'name', None) is not None:
             to_translate.append(y.name)
         for name in to_translate:
             if name not in self.dict:
@@ -37,43 +43,214 @@ class Translate(TransformerMixin, BaseEstimator):
         return self
 
     def transform(self, X, y=None):
-        from copy import deepcopy
-        new_X = deepcopy(X)
-        new_X.columns = list(map(lambda x: self.dict[x], X.columns))
+        if hasattr(X, 'columns'):
+            # Shallow copy: only the column names are new
+            X = X.copy(deep=False)
+            X.columns = [self.dict[name] for name in X.columns]
         if y is not None:
-            new_y = deepcopy(y)
-            new_y.name = self.dict[y.name]
-            return (new_X, new_y)
-        return new_X
+            if getattr(y, 'name', None) is not None:
+                y = y.rename(self.dict[y.name])
+            return (X, y)
+        return X
+
+def column_positions(X, classes):
+    '''Returns the positions of the columns `classes` in X (an array of ints).
+    If X has no column names (numpy array), `classes` must already be positions.'''
+    if not hasattr(X, 'columns'):
+        return np.asarray(classes, dtype=int)
+    positions = X.columns.get_indexer(classes)
+    if np.any(positions < 0):
+        raise Exception('Unknown columns ', [name for name, i in zip(classes, positions) if i < 0])
+    return positions
+
+def fitted_positions(transformer, X):
+    '''Returns the positions of `transformer.classes` in X: the ones resolved in `fit` if X
+    is a numpy array, or a DataFrame with exactly the columns seen in `fit`. Otherwise (the
+    columns are in another order, for example), they are resolved again by name.'''
+    if hasattr(X, 'columns') and not X.columns.equals(transformer.columns_):
+        return column_positions(X, transformer.classes)
+    return transformer.positions_
 
 class OnlyKeep(TransformerMixin, BaseEstimator):
     '''Very simple transformer that only keeps the columns in the list `classes` for X.
     Leaves the labels y untouched.
+    The column positions are resolved in `fit` (and again by name for a DataFrame whose
+    columns differ from the training data): a numpy array with the same columns as the
+    training data can then be transformed as well.
     Parameters
     ----------
-    classes : the list of classes to keep (by names)'''
+    classes : the list of classes to keep (by names, or by positions for numpy arrays)'''
     def __init__(self, classes):
         self.classes = classes
-    def fit(self, *args):
+    def fit(self, X, y=None):
+        self.columns_ = getattr(X, 'columns', None)
+        self.positions_ = column_positions(X, self.classes)
         return self
     def transform(self, X, y=None):
-        return X[self.classes]
+        if hasattr(X, 'columns'):
+            return X.iloc[:, fitted_positions(self, X)]
+        return np.asarray(X)[:, self.positions_]
 
 class InverseFeature(TransformerMixin, BaseEstimator):
     '''Multiply one or more columns by -1.
+    The column positions are resolved in `fit` (see OnlyKeep). For a DataFrame, only the
+    inverted columns are new, the others are shared with the input.
     Parameters
     ----------
-    classes : the list of classes to be transformed (by name)'''
+    classes : the list of classes to be transformed (by name, or by positions for numpy arrays)'''
     def __init__(self, classes):
         self.classes = classes
-    def fit(self, *args):
+    def fit(self, X, y=None):
+        self.columns_ = getattr(X, 'columns', None)
+        self.positions_ = column_positions(X, self.classes)
         return self
     def transform(self, X, y=None):
-        from copy import deepcopy
-        new_X = deepcopy(X)
-        new_X[self.classes] = -new_X[self.classes]
+        if hasattr(X, 'columns'):
+            names = X.columns[fitted_positions(self, X)]
+            return X.assign(**{name: -X[name] for name in names})
+        # One copy, with the dtype of X, and only the inverted columns are rewritten
+        new_X = np.array(X)
+        new_X[:, self.positions_] *= -1
         return new_X
 
+# ---------------
+# -- Model search
+# ---------------
+
+class PathGridSearchCV(BaseEstimator):
+    '''Grid search where some parameters (the "path" parameters) are evaluated together:
+    for each fold and each combination of the other parameters, `path` scores every
+    combination of the path parameters at once, sharing whatever it can between them.
+    Uses the same folds as GridSearchCV, and selects the first best candidate in
+    ParameterGrid order, like GridSearchCV.
+
+    Parameters
+    ----------
+    estimator : a sklearn Pipeline.
+    param_grid : the parameter grid.
+    path : a function path(estimator, candidates, X, y, train, test) returning the test
+        accuracy of the estimator (with the other parameters already set) for each dict of
+        path parameters in the list `candidates`, fitted on the `train` indices and evaluated
+        on the `test` indices.
+    path_params : the names of the path parameters.
+    cv : number of folds (stratified, as in GridSearchCV), or a cv splitter.
+    n_jobs : number of processes, one task per fold and per combination of the other parameters.'''
+    def __init__(self, estimator, param_grid, path, path_params, cv=k_cv, n_jobs=None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.path = path
+        self.path_params = path_params
+        self.cv = cv
+        self.n_jobs = n_jobs
+
+    def fit(self, X, y):
+        from sklearn.base import clone
+        from sklearn.model_selection import ParameterGrid, check_cv
+        from joblib import Parallel, delayed
+
+        path_grid = list(ParameterGrid({param: self.param_grid[param] for param in self.path_params}))
+        others = {param: values for param, values in self.param_grid.items() if param not in self.path_params}
+
+        folds = list(check_cv(self.cv, y, classifier=True).split(X, y))
+        tasks = [(params, train, test) for params in ParameterGrid(others) for train, test in folds]
+        fold_scores = Parallel(n_jobs=self.n_jobs)(
+            delayed(self.path)(clone(self.estimator).set_params(**params), path_grid, X, y, train, test)
+            for params, train, test in tasks)
+
+        # scores[candidate] = list of the scores on each fold
+        scores = {}
+        for (params, _train, _test), values in zip(tasks, fold_scores):
+            for path_params, score in zip(path_grid, values):
+                scores.setdefault(candidate_key({**params, **path_params}), []).append(score)
+
+        candidates = list(ParameterGrid(self.param_grid))
+        splits = np.array([scores[candidate_key(params)] for params in candidates])
+        self.cv_results_ = {'params': candidates, 'mean_test_score': np.mean(splits, axis=1)}
+        for i in range(splits.shape[1]):
+            self.cv_results_[f'split{i}_test_score'] = splits[:, i]
+
+        self.best_index_ = int(np.argmax(self.cv_results_['mean_test_score'])) # First best, as GridSearchCV
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = self.cv_results_['mean_test_score'][self.best_index_]
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
+
+def candidate_key(params):
+    '''Hashable key of a dict of parameters, independent of the order of the keys'''
+    return tuple(sorted(params.items(), key=str))
+
+class StagedGridSearchCV(PathGridSearchCV):
+    '''PathGridSearchCV over a pipeline whose final step is an ensemble, where the whole
+    `n_estimators` axis is evaluated from a single fit per fold and per combination of
+    the other parameters (see `staged_scores`).
+    With a fixed random_state this gives exactly the same scores as GridSearchCV (same
+    folds, same ensembles), and the same best parameters.
+
+    Parameters
+    ----------
+    estimator : a sklearn Pipeline, whose last step has a `n_estimators` parameter.
+    param_grid : the parameter grid, which must contain `<last step>__n_estimators`.
+    cv, n_jobs : see PathGridSearchCV.'''
+    def __init__(self, estimator, param_grid, cv=k_cv, n_jobs=None):
+        super().__init__(estimator, param_grid, staged_scores,
+                         [f'{estimator.steps[-1][0]}__n_estimators'], cv, n_jobs)
+
+def staged_scores(pipeline, candidates, X, y, train, test):
+    '''Path function (see PathGridSearchCV) over the `n_estimators` of the final step:
+     - estimators with `staged_predict` (AdaBoost) are fitted once with the largest
+       `n_estimators`, and every smaller value is scored with the staged predictions.
+     - the others (RandomForest) are grown with `warm_start`, from the smallest to the
+       largest `n_estimators`, and scored after each step.'''
+    X_train, y_train = X.iloc[train], y.iloc[train]
+    X_test, y_test = X.iloc[test], y.iloc[test]
+    name, final = pipeline.steps[-1]
+    key = f'{name}__n_estimators'
+    n_estimators = sorted(params[key] for params in candidates)
+
+    if hasattr(final, 'staged_predict'):
+        pipeline.set_params(**{key: n_estimators[-1]}).fit(X_train, y_train)
+        staged = list(final.staged_score(pipeline[:-1].transform(X_test), y_test))
+        # Boosting may stop early (perfect fit), a larger n_estimators then gives the same model
+        scores = {n: staged[min(n, len(staged)) - 1] for n in n_estimators}
+    else:
+        scores = {}
+        pipeline.set_params(**{f'{name}__warm_start': True})
+        for n in n_estimators:
+            pipeline.set_params(**{key: n}).fit(X_train, y_train)
+            scores[n] = pipeline.score(X_test, y_test)
+    return [scores[params[key]] for params in candidates]
+
+def poly_logistic_scores(pipeline, candidates, X, y, train, test, warm_start=False):
+    '''Path function (see PathGridSearchCV) over `poly__degree` and `logistic__C`, for a
+    pipeline ending with the steps 'poly' (PolynomialFeatures) and 'logistic':
+     - the steps before 'poly' are fitted once, and the polynomial expansion is computed
+       once at the largest degree. Lower degrees keep only the columns of lower degree.
+     - for each degree, the logistic regressions are fitted along the C path, from the
+       strongest to the weakest regularization. With `warm_start`, each one starts from the
+       previous solution: this is cheaper, but the solver stops at a slightly different point
+       (within its tolerance), which can change the selected model.'''
+    from sklearn.base import clone
+
+    X_train, y_train = X.iloc[train], y.iloc[train]
+    X_test, y_test = X.iloc[test], y.iloc[test]
+    steps = [name for name, _step in pipeline.steps]
+    preprocessing = pipeline[:steps.index('poly')]
+    poly = pipeline.named_steps['poly']
+
+    degrees = sorted({params['poly__degree'] for params in candidates})
+    poly.set_params(degree=degrees[-1])
+    X_train = poly.fit_transform(preprocessing.fit_transform(X_train, y_train))
+    X_test = poly.transform(preprocessing.transform(X_test))
+
+    scores = {}
+    for degree in degrees:
+        columns = poly.powers_.sum(axis=1) <= degree
+        logistic = clone(pipeline.named_steps['logistic']).set_params(warm_start=warm_start)
+        for C in sorted({params['logistic__C'] for params in candidates if params['poly__degree'] == degree}):
+            logistic.set_params(C=C).fit(X_train[:, columns], y_train)
+            scores[degree, C] = logistic.score(X_test[:, columns], y_test)
+    return [scores[params['poly__degree'], params['logistic__C']] for params in candidates]
+
 # ---------
 # -- Models
 # ---------
@@ -100,7 +277,7 @@ def get_benchmark_model(X_train, y_train):
 
     return clf.best_estimator_
 
-def get_poly_logistic_model(X_train, y_train):
+def get_poly_logistic_model(X_train, y_train, n_jobs=None, warm_start=False):
     '''Performs a cross-validation on the following pipeline:
     Keep important features -> inverse features
     -> MinMax scaler -> polynomial features -> Logistic regression
@@ -110,6 +287,8 @@ def get_poly_logistic_model(X_train, y_train):
     Parameters
     ----------
     X_train, y_train : the training data.
+    n_jobs : number of processes (one per fold, -1 for all cores).
+    warm_start : solve the C grid as a warm-started regularization path (see `poly_logistic_scores`).
 
     Returns
     -------
@@ -122,12 +301,43 @@ def get_poly_logistic_model(X_train, y_train):
                   ])
     params = {"logistic__C": [10**x for x in range(-3, 5)],
               "poly__degree": [2,3,4]}
-    clf = GridSearchCV(pl, params, cv=k_cv)
+    # The expansion is computed once per fold, at the largest degree
+    path = partial(poly_logistic_scores, warm_start=warm_start)
+    clf = PathGridSearchCV(pl, params, path, ['poly__degree', 'logistic__C'], n_jobs=n_jobs)
     clf.fit(X_train, y_train)
 
     return clf.best_estimator_
 
-def compare_models(X_train, y_train):
+def make_search(estimator, params, search='grid', n_jobs=None, random_state=None):
+    '''Builds the cross-validated search over `params` for `estimator`.
+
+    Parameters
+    ----------
+    estimator : a sklearn estimator (usually a Pipeline).
+    params : the parameter grid.
+    search : 'grid' for an exhaustive search, or 'halving' for a successive-halving
+        search (HalvingGridSearchCV): every candidate is first evaluated on a small part of
+        the training data, and only the best third is kept for the next, larger, round.
+        When the grid is exhaustive and contains the `n_estimators` of an ensemble (final step
+        of the pipeline), StagedGridSearchCV is used instead of GridSearchCV.
+    n_jobs : number of processes used to fit the candidates and folds (-1 for all cores).
+    random_state : seed used by the halving search to subsample the data.
+
+    Returns
+    -------
+    A sklearn search estimator, not yet fitted.'''
+    if search == 'grid':
+        final = estimator.steps[-1][0] if isinstance(estimator, Pipeline) else None
+        if final is not None and f'{final}__n_estimators' in params:
+            return StagedGridSearchCV(estimator, params, cv=k_cv, n_jobs=n_jobs)
+        return GridSearchCV(estimator, params, cv=k_cv, n_jobs=n_jobs)
+    if search == 'halving':
+        from sklearn.experimental import enable_halving_search_cv # noqa: F401 (enables the import below)
+        from sklearn.model_selection import HalvingGridSearchCV
+        return HalvingGridSearchCV(estimator, params, cv=k_cv, n_jobs=n_jobs, random_state=random_state)
+    raise Exception('Unknown search ', search)
+
+def compare_models(X_train, y_train, n_jobs=-1, search='grid', cache=True, random_state=None):
     '''Performs a cross-validation on the following pipeline:
     Keep important features -> MinMax scaler -> model
     Where the model is in :
@@ -142,6 +352,12 @@ def compare_models(X_train, y_train):
     Parameters
     ----------
     X_train, y_train : the training data.
+    n_jobs : number of processes used by each search (-1 for all cores).
+    search : 'grid' (exhaustive) or 'halving' (successive halving, cheaper). See `make_search`.
+    cache : if True, the fitted preprocessing steps (keeper and scaler) are cached on disk for
+        the duration of the search, so each fold's preprocessing is fitted once and shared
+        between all the candidates.
+    random_state : seed for the halving search, and for the AdaBoost and RandomForest models.
 
     Returns
     -------
@@ -151,13 +367,14 @@ def compare_models(X_train, y_train):
     from sklearn.svm import SVC
     from sklearn.neighbors import KNeighborsClassifier
     from sklearn.ensemble import AdaBoostClassifier, RandomForestClassifier
+    from tempfile import TemporaryDirectory
 
     models = [
         ('MLP', MLPClassifier(max_iter=10000)),
         ('SVM', SVC()),
         ('K-NN', KNeighborsClassifier()),
-        ('AdaBoost', AdaBoostClassifier()),
-        ('RandomForest', RandomForestClassifier())
+        ('AdaBoost', AdaBoostClassifier(random_state=random_state)),
+        ('RandomForest', RandomForestClassifier(random_state=random_state))
     ]
 
     params = [
@@ -171,16 +388,19 @@ def compare_models(X_train, y_train):
     ]
 
     best_models = []
-    for model, param in zip(models, params):
-        pl = Pipeline([
-            ('keeper', OnlyKeep(important_features)),
-            ('scaler', MinMaxScaler()),
-            model
-        ])
-        clf = GridSearchCV(pl, param, cv=k_cv)
-        clf.fit(X_train, y_train)
-        best_models.append((model[0], clf.best_estimator_)) # Save the best-performing models
-        print(model[0], clf.best_score_, clf.best_params_)  # Print the best scores and params
+    with TemporaryDirectory() as cache_dir:
+        for model, param in zip(models, params):
+            pl = Pipeline([
+                ('keeper', OnlyKeep(important_features)),
+                ('scaler', MinMaxScaler()),
+                model
+            ], memory=cache_dir if cache else None)
+            clf = make_search(pl, param, search, n_jobs, random_state)
+            clf.fit(X_train, y_train)
+            best = clf.best_estimator_
+            best.set_params(memory=None) # The cache directory is removed at the end
+            best_models.append((model[0], best)) # Save the best-performing models
+            print(model[0], clf.best_score_, clf.best_params_)  # Print the best scores and params
     return best_models
 
 # -----------------------
@@ -209,3 +429,119 @@ def class_accuracy(y_true, y_pred):
     A numpy array with the accuracies'''
     mat = confusion_matrix(y_true, y_pred)
     return mat.diagonal() / mat.sum(axis=1)
+
+# -------------------------
+# -- Persistence and scoring
+# -------------------------
+
+def save_model(clf, filename, features=None, **metadata):
+    '''Saves a fitted model (any sklearn estimator, e.g. from `get_benchmark_model` or
+    `compare_models`) with joblib, along with the feature names it expects.
+
+    Parameters
+    ----------
+    clf : the fitted estimator.
+    filename : the name of the file.
+    features : the columns the model was trained on, in order (usually `list(X_train.columns)`).
+        By default, the `feature_names_in_` of the model, if it has them.
+    metadata : anything else to save with the model (name, parameters, score...).'''
+    import joblib
+    if features is None:
+        features = getattr(clf, 'feature_names_in_', [])
+    features = list(features)
+    joblib.dump({'model': clf, 'features': features, 'metadata': metadata}, filename)
+
+def load_model(filename):
+    '''Loads a model saved by `save_model`.
+
+    Returns
+    -------
+    A tuple (model, features, metadata).'''
+    import joblib
+    artifact = joblib.load(filename)
+    return artifact['model'], artifact['features'], artifact['metadata']
+
+def predict_chunk(clf, features, chunk):
+    '''Returns a DataFrame with the predicted probability of death (NaN if the model has no
+    `predict_proba`) and the predicted label for every row of `chunk`, indexed like `chunk`.
+
+    Parameters
+    ----------
+    clf : a fitted estimator.
+    features : the columns to give to the model (all the columns but the label if empty).
+    chunk : a DataFrame, with the same schema as the training data.'''
+    X = chunk[features] if features else chunk.drop(columns='DEATH_EVENT', errors='ignore')
+    result = pd.DataFrame(index=chunk.index)
+    if hasattr(clf, 'predict_proba'):
+        probabilities = clf.predict_proba(X)
+        result['probability'] = probabilities[:, 1]
+        result['prediction'] = clf.classes_[np.argmax(probabilities, axis=1)]
+    else:
+        result['probability'] = np.nan
+        result['prediction'] = clf.predict(X)
+    return result
+
+# Model loaded once by each worker process of `score_csv`
+worker_model = {}
+
+def worker_init(model_file):
+    worker_model['model'], worker_model['features'], _ = load_model(model_file)
+
+def worker_predict(chunk):
+    return predict_chunk(worker_model['model'], worker_model['features'], chunk)
+
+def score_csv(model_file, input_file, output_file, chunk_size=100000, n_jobs=1, v=True):
+    '''Scores a (possibly very large) csv of patient records, with the same schema as
+    heart_failure_clinical_records_dataset.csv (the DEATH_EVENT column is optional).
+    The file is read and scored by chunks, and the results (row number, probability and
+    prediction) are appended to `output_file` as soon as each chunk is done, in order:
+    the memory used is bounded by a few chunks, whatever the size of the file.
+
+    Parameters
+    ----------
+    model_file : a model saved by `save_model`.
+    input_file, output_file : the csv to read, and the csv to write.
+    chunk_size : number of rows per chunk.
+    n_jobs : number of worker processes (1 scores in this process). At most 2 * n_jobs
+        chunks are read ahead.
+    v : print the progress and the throughput.
+
+    Returns
+    -------
+    A tuple (number of rows, rows per second).'''
+    from collections import deque
+    from multiprocessing import Pool
+
+    start = time.perf_counter()
+    clf, features, _ = load_model(model_file)
+    # Check the header before the output file is created
+    missing = [feature for feature in features if feature not in pd.read_csv(input_file, nrows=0).columns]
+    if missing:
+        raise Exception('Missing columns in ' + input_file, missing)
+    chunks = pd.read_csv(input_file, chunksize=chunk_size)
+    rows = 0
+
+    with open(output_file, 'w', newline='') as output:
+        def write(result):
+            nonlocal rows
+            result.to_csv(output, header=(rows == 0), index_label='row')
+            rows += len(result)
+            if v:
+                print(f'{rows} rows, {rows / (time.perf_counter() - start):.0f} rows/s')
+
+        if n_jobs == 1:
+            for chunk in chunks:
+                write(predict_chunk(clf, features, chunk))
+        else:
+            with Pool(n_jobs, initializer=worker_init, initargs=(model_file,)) as pool:
+                # Pool.imap would read the whole file ahead: the chunks in flight are bounded here
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(worker_predict, (chunk,)))
+                    if len(pending) >= 2 * n_jobs:
+                        write(pending.popleft().get())
+                while pending:
+                    write(pending.popleft().get())
+
+    elapsed = time.perf_counter() - start
+    return rows, rows / elapsed
@@ -0,0 +1,81 @@
+import time
+import tracemalloc
+from copy import deepcopy
+
+import numpy as np
+import pandas as pd
+
+from heart_data import *
+import heart
+
+# Timings and memory usage of the code in heart.py.
+
+def tile_data(n_rows):
+    '''Returns (X, y) with n_rows rows, by repeating the heart failure data.
+
+    Parameters
+    ----------
+    n_rows : the number of rows.'''
+    X, y = import_heart_data(x_and_y=True)
+    repeats = -(-n_rows // len(X)) # Ceiling division
+    X = pd.concat([X] * repeats, ignore_index=True).iloc[:n_rows]
+    y = pd.concat([y] * repeats, ignore_index=True).iloc[:n_rows]
+    return X, y
+
+def measure(function, *args, repeat=5):
+    '''Calls function(*args) `repeat` times.
+
+    Returns
+    -------
+    The best time (in seconds), and the peak memory allocated during one call (in bytes).'''
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def bench_transformers(rows=(300, 3000, 30000, 300000), repeat=5):
+    '''Measures the transform of the custom transformers (Translate, OnlyKeep and
+    InverseFeature) on DataFrames and on numpy arrays of increasing size. The
+    `deepcopy` line is the cost of copying the whole DataFrame (and the labels), which
+    the transformers used to pay on every call.
+
+    Parameters
+    ----------
+    rows : the numbers of rows to test.
+    repeat : the number of calls, the best time is kept.
+
+    Returns
+    -------
+    A list of dictionnaries with the name, the number of rows, the time and the peak memory.'''
+    results = []
+    for n_rows in rows:
+        X, y = tile_data(n_rows)
+        array = X.to_numpy(dtype=float)
+        translate = heart.Translate(translation).fit(X, y)
+        keep = heart.OnlyKeep(heart.important_features).fit(X)
+        inverse = heart.InverseFeature(['ejection_fraction']).fit(X)
+
+        cases = [
+            ('deepcopy', lambda: (deepcopy(X), deepcopy(y))),
+            ('Translate', lambda: translate.transform(X, y)),
+            ('OnlyKeep', lambda: keep.transform(X)),
+            ('OnlyKeep (numpy)', lambda: keep.transform(array)),
+            ('InverseFeature', lambda: inverse.transform(X)),
+            ('InverseFeature (numpy)', lambda: inverse.transform(array)),
+        ]
+        for name, function in cases:
+            seconds, peak = measure(function, repeat=repeat)
+            results.append({'name': name, 'rows': n_rows, 'time': seconds, 'peak_memory': peak})
+            print(f'{name:>22} {n_rows:>8} rows : {seconds*1000:9.3f} ms  {peak/1024:10.1f} KiB')
+    return results
+
+
+if __name__ == '__main__':
+    bench_transformers()
@@ -1,3 +1,5 @@
+import os
+import numpy as np
 import pandas as pd
 
 translation = {
@@ -16,7 +18,63 @@ translation = {
     'DEATH_EVENT' : 'mort'
 }
 
-def import_heart_data(x_and_y = False, translate = False, include_time=True):
+data_file = "heart_failure_clinical_records_dataset.csv"
+
+def narrow_dtype(values):
+    '''Returns the smallest dtype that holds the column `values` (a numpy array): int8,
+    int16 or int32 for integers (so the binary flags are int8, and stay 0/1 for the labels
+    and the arithmetic), float32 for floats.'''
+    if values.dtype.kind in 'iub':
+        for dtype in (np.int8, np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if values.size == 0 or (values.min() >= info.min and values.max() <= info.max):
+                return np.dtype(dtype)
+        return values.dtype
+    if values.dtype.kind == 'f':
+        return np.dtype(np.float32)
+    return values.dtype
+
+def build_cache(filename, cache_dir, key):
+    '''Reads the csv `filename` and writes every column, with a narrowed dtype (see
+    `narrow_dtype`), as a .npy file in `cache_dir`. The key (the size and modification date
+    of the csv, and the names of the columns) is written last: a cache without a valid key
+    is rebuilt.'''
+    data = pd.read_csv(filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    for i, column in enumerate(data.columns):
+        values = data[column].to_numpy()
+        np.save(os.path.join(cache_dir, f'{i}.npy'), values.astype(narrow_dtype(values)))
+    with open(os.path.join(cache_dir, 'key.tmp'), 'w') as file:
+        file.write(key + '\n' + '\n'.join(data.columns))
+    os.replace(os.path.join(cache_dir, 'key.tmp'), os.path.join(cache_dir, 'key'))
+
+def read_columns(filename=data_file, columns=None, cache=True):
+    '''Reads the csv `filename` (all the columns, or only the list `columns`).
+    With `cache`, a binary columnar copy (one .npy file per column, with narrowed dtypes,
+    in filename.cache/) is created at the first call. The next calls only load the
+    requested columns from it. It is rebuilt if the size or modification date of the csv
+    change.'''
+    if not cache:
+        return pd.read_csv(filename, usecols=columns)[columns] if columns is not None else pd.read_csv(filename)
+
+    stat = os.stat(filename)
+    key = f'{stat.st_size} {stat.st_mtime_ns}'
+    cache_dir = filename + '.cache'
+    try:
+        with open(os.path.join(cache_dir, 'key')) as file:
+            cached_key, *names = file.read().split('\n')
+    except FileNotFoundError:
+        cached_key = None
+    if cached_key != key:
+        build_cache(filename, cache_dir, key)
+        return read_columns(filename, columns, cache)
+
+    if columns is None:
+        columns = names
+    return pd.DataFrame({column: np.load(os.path.join(cache_dir, f'{names.index(column)}.npy'))
+                         for column in columns})
+
+def import_heart_data(x_and_y = False, translate = False, include_time=True, columns=None, cache=True):
     '''Loads the data from the accompanying .csv file.
 
     Parameters
@@ -24,9 +82,15 @@ def import_heart_data(x_and_y = False, translate = False, include_time=True):
     x_and_y (bool): separate features from the labels. In this case a tuple is returned.
     translate (bool): (mutually exclusive with x_and_y) : translate the columns in french.
         This option is only used for the plotting.
-    include_time (bool): whether to include the time column.'''
-    data = pd.read_csv("heart_failure_clinical_records_dataset.csv")
-    if not include_time:
+    include_time (bool): whether to include the time column.
+    columns (list): only load these columns (for example `heart.important_features`).
+        The labels are always loaded.
+    cache (bool): load from a binary columnar copy of the csv, with compact dtypes
+        (see `read_columns`). Without it, the csv is parsed with the default pandas dtypes.'''
+    if columns is not None:
+        columns = [column for column in columns if column != 'DEATH_EVENT'] + ['DEATH_EVENT']
+    data = read_columns(data_file, columns, cache)
+    if not include_time and 'time' in data.columns:
         data = data.drop(columns='time')
     if x_and_y:
         X, y = data.drop(columns='DEATH_EVENT'), data["DEATH_EVENT"]
@@ -35,4 +99,3 @@ def import_heart_data(x_and_y = False, translate = False, include_time=True):
         from heart import Translate
         data = Translate(translation).fit_transform(data)
     return data
-
@@ -2,17 +2,28 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import pandas as pd
 
+from functools import lru_cache
+
 from heart_data import *
 
-data = import_heart_data(translate=True)
-label = data.columns[-1]
+@lru_cache(maxsize=None)
+def get_data():
+    '''Loads the translated data the first time a plot needs it (not at import time).
+    The last column is the label.'''
+    return import_heart_data(translate=True)
+
+def make_feature_plot(feature, jitter=.02):
+    '''Generate the logistic regression plot for one feature.'''
+    data = get_data()
+    label = data.columns[-1]
+    plot = sns.regplot(x=feature, y=label, logistic=True, data=data, y_jitter=jitter)
+    plot.get_figure().savefig(f"plots/{feature}.png")
+    plt.clf() # clear everything
 
 def make_feature_plots(jitter=.02):
     '''Generate the logistic regression plot for every feature.'''
-    for feature in data.columns[:-1]:
-        plot = sns.regplot(x=feature, y=label, logistic=True, data=data, y_jitter=jitter)
-        plot.get_figure().savefig(f"plots/{feature}.png")
-        plt.clf() # clear everything
+    for feature in get_data().columns[:-1]:
+        make_feature_plot(feature, jitter)
 
 def make_bar_plot(names, values, filename):
     '''Generate a bar plot
@@ -32,6 +43,7 @@ def make_bar_plot(names, values, filename):
 def make_rf_importance_plot(n_estimators=200):
     '''Generates the Random Forest importance plot'''
     from sklearn.ensemble import RandomForestClassifier
+    data = get_data()
     rf = RandomForestClassifier(n_estimators=n_estimators)
     rf.fit(data.iloc[:, 0:-1], data.iloc[:, -1])
     make_bar_plot(names = data.columns[:-1],
@@ -40,6 +52,8 @@ def make_rf_importance_plot(n_estimators=200):
 
 def make_correlation_plot(absolute_value=True):
     '''Generates the correlation plot'''
+    data = get_data()
+    label = data.columns[-1]
     corr = data.corr()[label][:-1]
     if absolute_value:
         corr = corr.abs()
@@ -49,6 +63,7 @@ def make_correlation_plot(absolute_value=True):
 
 def make_creatinine_vs_ejection_fraction_plot():
     '''Generates the creatinine vs ejection plot'''
+    data = get_data()
     creatinine = data.columns[7]
     fraction = data.columns[4]
     death = data.columns[-1]
@@ -58,8 +73,89 @@ def make_creatinine_vs_ejection_fraction_plot():
     plt.clf()
 
 
-def make_all_plots():
-    make_feature_plots()
-    make_rf_importance_plot()
-    make_correlation_plot()
-    make_creatinine_vs_ejection_fraction_plot()
+# ---------------
+# -- Plot builds
+# ---------------
+
+stamps_file = 'plots/.stamps.json'
+
+def plot_tasks():
+    '''Returns the list of plots made by `make_all_plots`, as tuples
+    (name, function, parameters, functions it depends on, files it writes).'''
+    features = get_data().columns[:-1]
+    tasks = [(feature, make_feature_plot, {'feature': feature}, [make_feature_plot],
+              [f'plots/{feature}.png']) for feature in features]
+    tasks.append(('rf_importance', make_rf_importance_plot, {}, [make_rf_importance_plot, make_bar_plot],
+                  ['plots/rf_importance.png']))
+    tasks.append(('corr', make_correlation_plot, {}, [make_correlation_plot, make_bar_plot],
+                  ['plots/corr.png']))
+    tasks.append(('creatinine_vs_ejection_fraction', make_creatinine_vs_ejection_fraction_plot, {},
+                  [make_creatinine_vs_ejection_fraction_plot], ['plots/creatinine_vs_ejection_fraction.png']))
+    return tasks
+
+def task_hash(data_hash, function, parameters, dependencies):
+    '''Hash of everything a plot depends on: the data, the parameters, the source code
+    of the functions that draw it, and the code that loads and translates the data
+    (`get_data`, the loading functions of heart_data, `translation` and `Translate`).'''
+    import hashlib
+    import inspect
+    from heart import Translate
+    loaders = [get_data, import_heart_data, read_columns, build_cache, narrow_dtype, Translate]
+    content = [data_hash, function.__name__, repr(sorted(parameters.items())), repr(translation)]
+    content += [inspect.getsource(dependency) for dependency in loaders + dependencies]
+    return hashlib.sha256('\n'.join(content).encode()).hexdigest()
+
+def render(function, parameters):
+    '''Draws one plot in a worker process, on the non-interactive Agg backend, starting
+    from a new figure and the default style (as each plot sets the style it needs).'''
+    import matplotlib
+    plt.switch_backend('Agg')
+    plt.close('all')
+    matplotlib.rcdefaults()
+    function(**parameters)
+    plt.close('all')
+
+def make_all_plots(n_jobs=None, force=False):
+    '''Generates every plot inside `plots/`, in parallel worker processes.
+    A plot is only redrawn if its hash (see `task_hash`) changed since it was last drawn,
+    or if its file is missing. The hashes are kept in plots/.stamps.json.
+
+    Parameters
+    ----------
+    n_jobs : number of worker processes (default: the number of cores).
+    force : redraw every plot.
+
+    Returns
+    -------
+    The list of the names of the plots that were redrawn.'''
+    import hashlib
+    import json
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    with open(data_file, 'rb') as file:
+        data_hash = hashlib.sha256(file.read()).hexdigest()
+    try:
+        with open(stamps_file) as file:
+            stamps = json.load(file)
+    except FileNotFoundError:
+        stamps = {}
+
+    todo = []
+    for name, function, parameters, dependencies, outputs in plot_tasks():
+        current = task_hash(data_hash, function, parameters, dependencies)
+        if force or stamps.get(name) != current or not all(map(os.path.exists, outputs)):
+            todo.append((name, function, parameters, current))
+
+    if todo:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            futures = [(name, current, executor.submit(render, function, parameters))
+                       for name, function, parameters, current in todo]
+            for name, current, future in futures:
+                future.result()
+                stamps[name] = current
+                # Saved after every plot, so an interrupted build keeps what was done
+                with open(stamps_file, 'w') as file:
+                    json.dump(stamps, file, indent=1, sort_keys=True)
+
+    return [name for name, _function, _parameters, _current in todo]
@@ -0,0 +1,57 @@
+import argparse
+
+from sklearn.model_selection import train_test_split
+
+from heart_data import *
+import heart
+
+# Command line entry point to train, save and use the models of heart.py.
+#
+#   python heart_score.py train benchmark.joblib --model benchmark
+#   python heart_score.py score benchmark.joblib records.csv scores.csv --jobs 4
+
+trainers = {
+    'benchmark': heart.get_benchmark_model,
+    'poly': heart.get_poly_logistic_model,
+}
+
+def train(filename, model='benchmark', test_size=.25, random_state=None):
+    '''Trains one of the models of heart.py on the heart failure data, prints its
+    evaluation on a held-out test set and saves it with `heart.save_model`.
+
+    Parameters
+    ----------
+    filename : the name of the saved model.
+    model : 'benchmark' or 'poly' (see `trainers`).
+    test_size, random_state : passed to train_test_split.'''
+    X, y = import_heart_data(x_and_y=True)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
+    clf = trainers[model](X_train, y_train)
+    heart.evaluate_model(clf, X_test, y_test)
+    heart.save_model(clf, filename, list(X_train.columns), model=model, test_score=clf.score(X_test, y_test))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and use the heart failure models.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = commands.add_parser('train', help='train a model and save it')
+    train_parser.add_argument('model_file')
+    train_parser.add_argument('--model', choices=list(trainers), default='benchmark')
+    train_parser.add_argument('--seed', type=int, default=None)
+
+    score_parser = commands.add_parser('score', help='score a csv of patient records by chunks')
+    score_parser.add_argument('model_file')
+    score_parser.add_argument('input_file')
+    score_parser.add_argument('output_file')
+    score_parser.add_argument('--chunk-size', type=int, default=100000)
+    score_parser.add_argument('--jobs', type=int, default=1)
+    score_parser.add_argument('--quiet', action='store_true')
+
+    args = parser.parse_args()
+    if args.command == 'train':
+        train(args.model_file, args.model, random_state=args.seed)
+    else:
+        rows, rate = heart.score_csv(args.model_file, args.input_file, args.output_file,
+                                     args.chunk_size, args.jobs, v=not args.quiet)
+        print(f'Scored {rows} rows ({rate:.0f} rows/s)')
@@ -0,0 +1,198 @@
+from kmeans import *
+import example_data
+import json
+import subprocess
+import time
+from datetime import datetime
+
+# Fichier dédié à la mesure des performances de kmeans.py.
+
+
+#-------- Jeux de données ----------#
+
+def datasets(seed=0):
+	'''Renvoie une liste de (nom, données, k) sur lesquels comparer les
+	méthodes : les exemples 2D (générés avec la graine seed), iris et
+	optdigits.'''
+	np.random.seed(seed)
+	return [
+		('diffuse_4', example_data.diffuse_4(), 4),
+		('concentrated_6', example_data.concentrated_6(), 6),
+		('iris', load_data('iris.data')[:,:4], 3),
+		('optdigits', load_data('optdigits.tra', dtype=np.uint8)[:,:-1], 10)
+	]
+
+def synthetic(n, k, d, seed=0):
+	'''Données synthétiques (random_dataset) : n points répartis autour de
+	k centres tirés au hasard en dimension d'''
+	np.random.seed(seed)
+	return random_dataset(np.random.randn(k, d)*5, max(1, n//k), 1)
+
+
+#-------- Initialisations ----------#
+
+def compare_init(restarts=(1, 5, 10), inits=('random', 'k-means++', 'k-means||'), seed=0):
+	'''Compare les initialisations : pour chaque jeu de données et chaque
+	nombre de relances de k_means_best, affiche le temps total et la
+	variance intra-classe finale. Renvoie la liste des résultats.'''
+
+	results = []
+	for name, data, k in datasets(seed):
+		for n in restarts:
+			for init in inits:
+				np.random.seed(seed)
+				start = time.perf_counter()
+				centers, partition = k_means_best(data, k, n, init=init)
+				elapsed = time.perf_counter() - start
+
+				v = intra_variance(data, centers, partition)
+				results.append({'dataset': name, 'k': k, 'restarts': n, 'init': init,
+				                'time': elapsed, 'intra_variance': v})
+				print(f'{name:>15} n={n:<3} {init:>10} : {elapsed:8.3f}s  {v:.6g}')
+
+	return results
+
+
+
+#-------- Index spatial ----------#
+
+def compare_index(n=20000, dims=(2, 8, 64), ks=(10, 50, 200), indexes=(None, 'kdtree', 'balltree'), seed=0):
+	'''Compare le temps de assign avec la force brute vectorisée (None) et
+	avec un index spatial sur les centres, sur des données synthétiques
+	(random_dataset) pour différents k et d. Renvoie la liste des résultats.'''
+
+	results = []
+	for d in dims:
+		for k in ks:
+			data = synthetic(n, k, d, seed)
+			centers = random_centers_init(data, k)
+			for index in indexes:
+				# Un premier appel pour ne pas mesurer l'import de scipy/sklearn
+				assign(data[:10], centers, index=index)
+				start = time.perf_counter()
+				assign(data, centers, index=index)
+				elapsed = time.perf_counter() - start
+
+				results.append({'d': d, 'k': k, 'n': data.shape[0], 'index': str(index), 'time': elapsed})
+				print(f'd={d:<3} k={k:<4} {str(index):>9} : {elapsed:8.4f}s')
+
+	return results
+
+
+
+#-------- Suite de benchmarks ----------#
+# Mesure les fonctions principales de kmeans.py en faisant varier n, k et d,
+# et enregistre les résultats (une ligne json par mesure) pour pouvoir
+# comparer les versions entre elles.
+
+def best_time(function, *args, repeat=3, seed=0, **kwargs):
+	'''Renvoie le meilleur temps (en secondes) sur repeat appels, avec la
+	même graine à chaque appel'''
+	times = []
+	for _useless in range(repeat):
+		np.random.seed(seed)
+		start = time.perf_counter()
+		function(*args, **kwargs)
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+def suite_cases(quick=False):
+	'''Renvoie la liste des (nom, données, k) mesurés : n, k et d varient
+	autour de (10000, 10, 8), plus les jeux de données réels.'''
+	base_n, base_k, base_d = (2000, 10, 8) if quick else (10000, 10, 8)
+	factors = (1, 4) if quick else (1, 4, 16)
+
+	cases = datasets()
+	for f in factors:
+		cases.append((f'n={base_n*f}', synthetic(base_n*f, base_k, base_d), base_k))
+		cases.append((f'k={base_k*f}', synthetic(base_n, base_k*f, base_d), base_k*f))
+		cases.append((f'd={base_d*f}', synthetic(base_n, base_k, base_d*f), base_k))
+	return cases
+
+def git_commit():
+	'''Renvoie le commit courant, pour savoir quelle version a été mesurée'''
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+	except OSError:
+		return None
+
+def run_suite(output='kmeans_bench.jsonl', quick=False, restarts=5, global_max_n=1000, v=True):
+	'''Lance toute la suite et ajoute les résultats à la fin du fichier
+	output (une ligne json par mesure). global_init étant en O(n²), il
+	n'est mesuré que pour n <= global_max_n. davies_bouldin est mesuré
+	par db_sweep (le même calcul, sans le graphe).
+	Renvoie la liste des résultats.'''
+
+	run = {'run': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit()}
+	results = []
+
+	for name, data, k in suite_cases(quick):
+		n, d = data.shape
+		np.random.seed(0)
+		centers, partition = k_means(data, k=k)
+
+		timings = {
+			'k_means': best_time(k_means, data, k=k),
+			'k_means_best': best_time(k_means_best, data, k, restarts, repeat=1),
+			'intra_variance': best_time(intra_variance, data, centers, partition),
+			'davies_bouldin': best_time(db_sweep, data, 2, min(k, 8), seed=0, repeat=1)
+		}
+		if n <= global_max_n:
+			timings['global_init'] = best_time(global_init, data, k, repeat=1)
+
+		for function, seconds in timings.items():
+			results.append({**run, 'case': name, 'function': function, 'n': n, 'k': k, 'd': d, 'time': seconds})
+			if v:
+				print(f'{name:>15} {function:>15} : {seconds:9.4f}s')
+
+	with open(output, 'a') as file:
+		for result in results:
+			file.write(json.dumps(result) + '\n')
+
+	return results
+
+def compare_runs(filename='kmeans_bench.jsonl', threshold=1.2):
+	'''Compare les deux dernières exécutions enregistrées dans filename, et
+	affiche les mesures qui ont ralenti (ou accéléré) de plus de threshold.
+	Renvoie la liste des (cas, fonction, ancien temps, nouveau temps).'''
+
+	with open(filename) as file:
+		results = [json.loads(line) for line in file if line.strip()]
+
+	runs = sorted({result['run'] for result in results})
+	if len(runs) < 2:
+		raise Exception('At least two runs are needed for a comparison')
+
+	old = {(r['case'], r['function']): r['time'] for r in results if r['run'] == runs[-2]}
+	new = {(r['case'], r['function']): r['time'] for r in results if r['run'] == runs[-1]}
+
+	changes = []
+	for key in sorted(old.keys() & new.keys()):
+		ratio = new[key]/old[key]
+		if ratio > threshold or ratio < 1/threshold:
+			changes.append((*key, old[key], new[key]))
+			label = 'slower' if ratio > 1 else 'faster'
+			print(f'{key[0]:>15} {key[1]:>15} : {old[key]:9.4f}s -> {new[key]:9.4f}s ({ratio:.2f}x, {label})')
+
+	return changes
+
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Benchmarks de kmeans.py')
+	parser.add_argument('--output', default='kmeans_bench.jsonl', help='fichier de résultats (json lines)')
+	parser.add_argument('--quick', action='store_true', help='tailles réduites')
+	parser.add_argument('--compare', action='store_true', help='compare les deux dernières exécutions')
+	parser.add_argument('--init', action='store_true', help='compare les initialisations')
+	parser.add_argument('--index', action='store_true', help='compare les index spatiaux')
+	args = parser.parse_args()
+
+	if args.init:
+		compare_init()
+	elif args.index:
+		compare_index()
+	elif args.compare:
+		compare_runs(args.output)
+	else:
+		run_suite(args.output, args.quick)
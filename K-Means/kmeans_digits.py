@@ -2,54 +2,105 @@ from kmeans import *
 
 # Fichier dédié à l'analyse de la base de donnée "optdigits".
 
+# Les pixels (et les labels) sont des entiers entre 0 et 16 : on les charge
+# en uint8, 8 fois plus petit que des float64.
+digits_dtype = np.uint8
+
 
 #-------- Partie K-means ----------#
 
 def get_classification(data, centers, v=True):
 	'''Compte le nombre de fois où un point se retrouve dans chaque classe,
 	pour tout les points dans data qui correspondent au chiffre p'''
-	k = centers.shape[0]
-
-	# Counts va compter le nombre d'occurence de chaque label rencontré,
-	# pour chaque centre. counts(i, j) = nombre de point associés au 
-	# centre i qui ont le label j.
-	counts = np.zeros((k,10))
-	for point in data:
-		p = int(point[-1])
-		counts[minimize_distance(centers, point[:-1]), p] += 1
-
-	# classifiction associe chaque centre à un chiffre. On utilise counts,
-	# et on choisit le centre i, le j qui maximise counts[i,j]
-	classification = np.empty(k, dtype=int)
-	for i in range(k):
-		digit = np.argmax(counts[i,:])
-		classification[i] = digit
+
+	# Counts compte le nombre d'occurence de chaque label rencontré, pour
+	# chaque centre. counts(i, j) = nombre de point associés au centre i
+	# qui ont le label j. classification associe alors à chaque centre i
+	# le j qui maximise counts[i,j].
+	model = KMeansModel(centers)
+	counts = model.fit_classification(data[:,:-1], data[:,-1], 10)
 
 	# Option verbose pour afficher plus d'information. Actif par défault.
 	if v:
-		print(classification)
+		print(model.classification)
 		print(counts)
 
-	return(classification)
+	return model.classification
+
+
+def save_model(centers, filename='digits.model', projection=None, **metadata):
+	'''Sauvegarde les centres, avec la classification calculée sur les
+	données d'apprentissage (et la projection éventuelle), sous forme de
+	KMeansModel'''
+
+	data = load_data("optdigits.tra", dtype=digits_dtype)
+	model = KMeansModel(centers, metadata=metadata, projection=projection)
+	model.fit_classification(data[:,:-1], data[:,-1], 10)
+	model.save(filename)
+
+def load_model(filename='digits.model'):
+	'''Charge un KMeansModel. Les anciens fichiers .result (les centres en
+	texte) sont aussi acceptés, la classification est alors recalculée.'''
+
+	if filename.endswith('.result'):
+		data = load_data("optdigits.tra", dtype=digits_dtype)
+		model = KMeansModel(load_data(filename, cache=False))
+		model.fit_classification(data[:,:-1], data[:,-1], 10)
+		return model
+	return KMeansModel.load(filename)
 
 
-def learn(n, k):
-	'''lance l'algo des k-means sur les données d'apprentissage, n fois'''
+def get_projection(kind='pca', dim=16, seed=0):
+	'''Renvoie la projection (voir Projection) des données d'apprentissage
+	en dimension dim. Elle n'est calculée qu'une fois, puis gardée dans
+	optdigits.tra.kind.dim.seed.proj (recalculée si optdigits.tra change).'''
+
+	filename = f'optdigits.tra.{kind}.{dim}.{seed}.proj'
+	if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime("optdigits.tra"):
+		return Projection.load(filename)
+
+	data = load_data("optdigits.tra", dtype=digits_dtype)[:,:-1]
+	projection = Projection(kind, dim).fit(data, random_state=seed)
+	projection.save(filename)
+	return projection
+
+
+def learn(n, k, projection=None, dim=16, filename='digits.model'):
+	'''lance l'algo des k-means sur les données d'apprentissage, n fois.
+	projection ('pca' ou 'random') projette d'abord les données en
+	dimension dim, la même projection est enregistrée avec le modèle.'''
 
 	# On retire la dernière colone (les labels), car on ne veut lancer
 	# l'algo que sur les données graphiques.
-	data = load_data("optdigits.tra")[:,:-1]
+	data = load_data("optdigits.tra", dtype=digits_dtype)[:,:-1]
 
-	centers, partition = k_means_best(data, k, n)
+	if projection is not None:
+		projection = get_projection(projection, dim)
+		data = projection.transform(data)
 
-	save_data("digits.result", centers)
+	centers, partition = k_means_best(data, k, n)
 
-def learn_global(k):
-	data = load_data("optdigits.tra")[:,:-1]
-	centers, partition = global_init(data, k, v=True)
+	metadata = {} if projection is None else {'reduction': projection.kind, 'dim': dim}
+	save_model(centers, filename, projection, method='k_means_best', k=k, n=n, **metadata)
+
+def learn_global(k, fast=True, candidates=None):
+	'''Initialisation par global k-means, puis k-means. Par défaut la
+	variante rapide est utilisée (voir fast_global_init pour candidates).'''
+	data = load_data("optdigits.tra", dtype=digits_dtype)[:,:-1]
+	if fast:
+		centers, partition = fast_global_init(data, k, candidates, v=True)
+	else:
+		centers, partition = global_init(data, k, v=True)
 	centers, partition = k_means(data, centers, partition)
 
-	save_data("digits.result", centers)
+	save_model(centers, method='global', k=k, fast=fast)
+
+def learn_stream(k, chunk_size=500, n_epochs=5):
+	'''k-means par mini-batch : le fichier d'apprentissage est lu par blocs
+	de chunk_size lignes, sans jamais être chargé en entier.'''
+	centers = mini_batch_k_means("optdigits.tra", k, chunk_size, n_epochs, usecols=range(64))
+
+	save_model(centers, method='mini_batch', k=k, chunk_size=chunk_size, n_epochs=n_epochs)
 
 
 #-------- Partie affichage -----#
@@ -79,28 +130,28 @@ def show_centers(centers, classification):
 
 #--------- Partie test ---------#
 
-def test(filename='digits.result', v=True, graph=True):
+def test(filename='digits.model', v=True, graph=True, index=None):
 	'''Affiche  les taux de bonne réponse pour chaque chiffre, ainsi que le
 	chiffre prédit en fonction du chiffre réel (sous forme d'une matrice)
-	Utilise les postions des centres (pré-calculés par la fonction learn)
-	enregistrées dans digits.result
+	Utilise le modèle (pré-calculé par la fonction learn) enregistré dans
+	digits.model
+	index ('kdtree' ou 'balltree') utilise un index spatial sur les centres.
 	Renvoie le taux de bonne réponse global.'''
 
-	# On charge les données du dataset d'apprentissage, et les centre
-	# obtenus par k-means, pour obtenir la classification.
-	data = load_data("optdigits.tra")
-	centers = load_data(filename)
-	classification = get_classification(data, centers, v=v)
+	# On charge le modèle : les centres obtenus par k-means, et la
+	# classification calculée sur les données d'apprentissage.
+	model = load_model(filename)
+	if v:
+		print(model.classification)
 
 	# On charge les donées test
-	data_test = load_data("optdigits.tes")
+	data_test = load_data("optdigits.tes", dtype=digits_dtype)
 
 	# Cette matrice accuracy donne le taux de chiffre prédit en fonction
 	# du chiffre réel (i=chiffre réel j=chiffre prédit)
-	accuracy = np.zeros((10,10), dtype=int)
-	for point in data_test:
-		predicted = classification[minimize_distance(centers, point[:-1])]
-		accuracy[int(point[-1]), predicted] += 1
+	accuracy = confusion_matrix(data_test[:,-1], model.classify(data_test[:,:-1], index), 10)
+
+	global_rate = np.trace(accuracy)/np.sum(accuracy)
 
 	# Verbose : affiche plus d'informations
 	if v:
@@ -109,33 +160,78 @@ def test(filename='digits.result', v=True, graph=True):
 			rate = accuracy[i,i]/np.sum(accuracy[i,:])
 			print(f'{i} : {rate:.2f}')
 
-		diag = 0
-		for i in range(10):
-			diag += accuracy[i,i]
-
-		global_rate = diag/np.sum(accuracy)
 		print(f'Total : {global_rate}')
 
 	# Option pour afficher graphiquement la matrice accuracy.
 	if graph:
 		plt.matshow(accuracy)
 		plt.show()
-		show_centers(centers, classification)
+		centers = model.centers
+		if model.projection is not None:
+			centers = model.projection.inverse_transform(centers)
+		show_centers(centers, model.classification)
 
 
 	# Retourne le taux de bonne réponse global.
 	return global_rate
 
 
-def influence_of_k(n):
-	test_values = np.array([10, 11, 12, 13, 14, 15, 20, 25, 30, 40, 50, 70, 100, 200])
-	scores = np.zeros(test_values.shape)
-	for i in range(test_values.shape[0]):
-		k = test_values[i]
-		learn(n, test_values[i])
-		scores[i] = test(graph=False)
-	plt.plot(test_values, scores)
-	plt.show()
+def influence_of_k(n, test_values=(10, 11, 12, 13, 14, 15, 20, 25, 30, 40, 50, 70, 100, 200), graph=True):
+	'''Taux de bonne réponse en fonction de k. Les données sont chargées
+	une seule fois, et chaque k part de la solution du k précédent (voir
+	k_sweep) : seul le premier k est relancé n fois.
+	Renvoie (valeurs de k, taux).'''
+
+	data = load_data("optdigits.tra", dtype=digits_dtype)
+	data_test = load_data("optdigits.tes", dtype=digits_dtype)
+
+	K, scores = [], []
+	for k, centers, partition in k_sweep(data[:,:-1], test_values, n):
+		# La partition des données d'apprentissage est déjà connue
+		model = KMeansModel(centers)
+		model.classification = np.argmax(confusion_matrix(partition, data[:,-1], k, 10), axis=1)
+		accuracy = confusion_matrix(data_test[:,-1], model.classify(data_test[:,:-1]), 10)
+		K.append(k)
+		scores.append(np.trace(accuracy)/np.sum(accuracy))
+
+	if graph:
+		plt.plot(K, scores)
+		plt.show()
+	return np.array(K), np.array(scores)
+
+def projection_report(n, k, dims=(4, 8, 16, 32), kinds=('pca', 'random'), repeat=5):
+	'''Pour chaque projection et chaque dimension (et sans projection, en
+	dimension 64), affiche le temps d'apprentissage (learn), le temps de
+	prédiction sur les données test (meilleur de repeat) et le taux de
+	bonne réponse. Renvoie la liste des résultats.'''
+
+	data_test = load_data("optdigits.tes", dtype=digits_dtype)[:,:-1]
+	settings = [(None, 64)] + [(kind, dim) for kind in kinds for dim in dims]
+	results = []
+	for kind, dim in settings:
+		if kind is not None:
+			get_projection(kind, dim)  # Calculée une fois, hors du temps d'apprentissage
+
+		np.random.seed(0)
+		start = time.perf_counter()
+		learn(n, k, kind, dim, filename='report.model')
+		train_time = time.perf_counter() - start
+
+		model = load_model('report.model')
+		inference_time = np.inf
+		for _useless in range(repeat):
+			start = time.perf_counter()
+			model.classify(data_test)
+			inference_time = min(inference_time, time.perf_counter() - start)
+
+		rate = test('report.model', v=False, graph=False)
+		results.append({'projection': kind, 'dim': dim, 'train_time': train_time,
+		                'inference_time': inference_time, 'accuracy': rate})
+		print(f'{str(kind):>7} d={dim:<3} : apprentissage {train_time:7.3f}s  '
+		      f'prédiction {inference_time*1000:7.2f}ms  taux {rate:.4f}')
+
+	os.remove('report.model')
+	return results
 
 
 